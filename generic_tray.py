@@ -42,10 +42,11 @@ Type the following to see all options:
 """
 from solid import *
 from solid.utils import *
-from ast import literal_eval
+from array import array
 from math import sqrt, pi
+from functools import lru_cache
+from itertools import accumulate
 import os
-import time
 import sys
 import optparse
 import subprocess
@@ -67,34 +68,54 @@ except:
     xiAdj, yiAdj, zAdj = 0.0, 0.0, 0.0
     xoAdj, yoAdj = 0.0, 0.0
 
+# The ASCII diagram has a 10-char margin on the left for the row labels
+diagramMargin = ' ' * 10
+diagramRowPrefix = diagramMargin + '|'
+
 ################################################################################
 # This will create a plug that can be subtracted from the tray frame/box
 def createSubtractSlot(offsetX, offsetY, sizeX, sizeY, binDepth,
                        roundDepth=15, trayFloor=1.5):
+    return translate( [offsetX, offsetY, 0]) \
+        (
+            _slotTemplate(sizeX, sizeY, binDepth, roundDepth, trayFloor)
+        )
+
+# The plug itself, with its corner at the origin.  Slots of the same size are
+# geometrically identical apart from their position, so while building a tray
+# each distinct slot is only built once in Python and then translated into
+# place (createTray clears the cache, so trays never share slot objects).  The
+# plug pokes 0.001mm out of the top of the tray so the subtraction doesn't
+# leave a paper-thin skin.
+@lru_cache(maxsize=None)
+def _slotTemplate(sizeX, sizeY, binDepth, roundDepth=15, trayFloor=1.5):
 
     sizeX = float(sizeX)
     sizeY = float(sizeY)
 
     # If round-depth is zero, it's just a square plug
     if roundDepth <= 0:
-        return translate( [offsetX, offsetY, trayFloor]) \
+        return translate( [0, 0, trayFloor]) \
             (
-                cube( [sizeX, sizeY, depth * 1.1])
+                cube( [sizeX, sizeY, binDepth + 0.001])
             )
 
     # Create 1:1 aspect, then stretch the whole thing at once
     # Prism sitting with corner at origin
-    fullPrism = cube( [sizeX, sizeX, depth * 1.1])
+    fullPrism = cube( [sizeX, sizeX, binDepth + 0.001])
 
 
     # Prism translated in the z-dir by the roundDepth
     partPrism = translate( [0, 0, roundDepth]) \
         (
-            cube( [sizeX, sizeX, depth * 1.1])
+            cube( [sizeX, sizeX, binDepth - roundDepth + 0.001])
         )
 
     # Start by creating a sphere in the center, scale it in y- an z-, then
-    # translate it to the bottom of the partPrism
+    # translate it to the bottom of the partPrism.  Only the bottom of the
+    # sphere survives the intersection, so it doesn't need the global $fn=64;
+    # a quarter of the facets keeps the scoop smooth and is much cheaper for
+    # OpenSCAD to intersect.
     sphereRad = sqrt(2) * sizeX / 2.0
     sphereScaleZ = roundDepth / sphereRad
 
@@ -102,11 +123,11 @@ def createSubtractSlot(offsetX, offsetY, sizeX, sizeY, binDepth,
         (
             scale( [1, 1, sphereScaleZ]) \
             (
-                sphere(sphereRad)
+                sphere(sphereRad, segments=32)
             )
         )
 
-    return translate( [offsetX, offsetY, trayFloor]) \
+    return translate( [0, 0, trayFloor]) \
         (
             scale( [1, sizeY / sizeX, 1]) \
             (
@@ -123,7 +144,7 @@ def createSubtractSlot(offsetX, offsetY, sizeX, sizeY, binDepth,
         )
 
 ################################################################################
-def computeSlotVolume(xsz, ysz, depth, rdepth):
+def computeSlotVolumes(xlist, ylist, depth, rdepth):
     """
     UPDATED:  Now we do this calculation exactly.  We compute the volume of the
     prism and then compute the volume of the hemisphere.  The hemisphere is
@@ -143,67 +164,95 @@ def computeSlotVolume(xsz, ysz, depth, rdepth):
 
     Don't forget to cut the resultant sph cap volume in half, because we're
     only removing half of a cap (because it's from half a hemisphere)
-    """
 
-    #
-    sphereRad = sqrt(2) * xsz / 2.0
-    sphereScaleY = ysz / xsz
-    sphereScaleZ = rdepth / sphereRad
+    The volumes of every slot in the tray are computed in one pass, and
+    returned as two tables (mL and cups) indexed by [row][column], where the
+    rows follow ylist and the columns follow xlist.
+    """
 
-    a = xsz / 2.0
-    h = sphereRad - a
-    oneCapFullVol = pi * h * (3 * a * a + h * h) / 6.0
+    # Both parts of the volume are linear in the y-size, so the rest only
+    # depends on the column.  Work out each column's volume per mm of y once.
+    # If round-depth is zero (or negative), the slots are just square plugs
+    # (see createSubtractSlot), with no rounded bottom to work out at all.
+    if rdepth <= 0:
+        colVolPerY_mm2 = [depth * xsz for xsz in xlist]
+    else:
+        colVolPerY_mm2 = []
+        for xsz in xlist:
+            sphereRad = sqrt(2) * xsz / 2.0
+            sphereScaleZ = rdepth / sphereRad
 
-    fullSphereVol = 4.0 * pi * sphereRad ** 3 / 3.0
+            a = xsz / 2.0
+            h = sphereRad - a
+            oneCapFullVol = pi * h * (3 * a * a + h * h) / 6.0
 
-    roundVol_mm3 = (fullSphereVol - 4 * oneCapFullVol) / 2.0
-    roundVol_mm3 *= sphereScaleY
-    roundVol_mm3 *= sphereScaleZ
+            fullSphereVol = 4.0 * pi * sphereRad ** 3 / 3.0
 
-    prismTop_mm3 = (depth - rdepth) * xsz * ysz
-    totalVol_mm3 = prismTop_mm3 + roundVol_mm3
+            # The y-scale of the hemisphere is ysz / xsz, applied per row below
+            roundVolPerY_mm2 = (fullSphereVol - 4 * oneCapFullVol) / 2.0
+            roundVolPerY_mm2 /= xsz
+            roundVolPerY_mm2 *= sphereScaleZ
 
-    # Now convert to both cups and mL (imperial and metric)
-    totalVol_cm3 = totalVol_mm3 / 10 ** 3
-    totalVol_mL = totalVol_cm3           # 1 cm3 == 1 mL  !
-    totalVol_cups = totalVol_mm3 / 236588.
+            prismTopPerY_mm2 = (depth - rdepth) * xsz
+            colVolPerY_mm2.append(prismTopPerY_mm2 + roundVolPerY_mm2)
 
-    return [totalVol_mL, totalVol_cups]
+    mLTable = []
+    cupsTable = []
+    for ysz in ylist:
+        mLRow = []
+        cupsRow = []
+        for volPerY_mm2 in colVolPerY_mm2:
+            totalVol_mm3 = volPerY_mm2 * ysz
 
-def createTray(xlist, ylist, dep, rdep=15, wall=1.5, floor=1.5):
+            # Now convert to both cups and mL (imperial and metric)
+            totalVol_cm3 = totalVol_mm3 / 10 ** 3
+            mLRow.append(totalVol_cm3)           # 1 cm3 == 1 mL  !
+            cupsRow.append(totalVol_mm3 / 236588.)
+        mLTable.append(mLRow)
+        cupsTable.append(cupsRow)
 
-    # Create all the slots to be subtracted from the frame of the tray.
-    slots = []
-    xOff = wall
-    yOff = wall
+    return [mLTable, cupsTable]
 
-    for ysz in ylist:
-        xOff = wall
-        for xsz in xlist:
-            slots.append(createSubtractSlot(xOff, yOff, xsz, ysz, dep, rdep, floor))
-            xOff += wall + xsz
-        yOff += wall + ysz
+################################################################################
+# The bin sizes are given on the command line as lists like [40,25,70]
+def parseList(s):
+    return [float(tok) for tok in s.strip().lstrip('[').rstrip(']').split(',')
+            if tok.strip()]
 
-    # The loops leave xOff & yOff at the upper-left corner of the tray.  Perfect!
-    totalWidth = xOff
-    totalHeight = yOff
+def createTray(xlist, ylist, dep, rdep=15, wall=1.5, floor=1.5):
 
-    # We have a list of "slots", unionize them.
-    allStuffToSubtract = union() (*slots)
+    # Slot objects are mutable and get attached to this tray, so don't reuse
+    # any that were built for a previous tray
+    _slotTemplate.cache_clear()
+
+    # Each slot starts one wall past the end of the previous one.  The last
+    # running sum is the far edge of the tray, which is exactly the tray size.
+    xEdges = list(accumulate([wall] + [xsz + wall for xsz in xlist]))
+    yEdges = list(accumulate([wall] + [ysz + wall for ysz in ylist]))
+    totalWidth = xEdges[-1]
+    totalHeight = yEdges[-1]
+
+    # Create all the slots to be subtracted from the frame of the tray.  The
+    # printer-calibration data is applied to every dimension here, rather than
+    # by scaling the finished tray.
+    slots = [createSubtractSlot(xOff * xScale, yOff * yScale,
+                                xsz * xScale, ysz * yScale,
+                                dep * zScale, rdep * zScale, floor * zScale)
+             for yOff,ysz in zip(yEdges, ylist)
+             for xOff,xsz in zip(xEdges, xlist)]
 
     # Create the prism from which the slots will be subtracted
-    trayBasePrism = cube( [totalWidth, totalHeight, floor + depth])
+    trayBasePrism = cube( [totalWidth * xScale, totalHeight * yScale,
+                           (floor + dep) * zScale])
 
-    # Finally, create the object and scale by the printer-calibration data
+    # Finally, create the object.  The slots never overlap, so they are
+    # subtracted directly rather than being unioned together first.
     return [totalWidth, totalHeight,
-            scale( [xScale, yScale, zScale]) \
-                (
-                    difference() \
-                    (
-                        trayBasePrism,
-                        allStuffToSubtract
-                    )
-                )]
+            difference() \
+            (
+                trayBasePrism,
+                *slots
+            )]
 
 if __name__ == "__main__":
     parser = optparse.OptionParser(usage="%prog [options]\n")
@@ -217,6 +266,10 @@ if __name__ == "__main__":
                       help="Height of tapered bottom (mm, default 15)")
     parser.add_option("--outfile", dest="outfile", default='', type="str",
                       help="The output name of the resultant file")
+    parser.add_option("--backend", dest="backend", default='manifold', type="str",
+                      help="OpenSCAD geometry backend used for the STL file, "
+                           "if openscad supports --backend (default manifold, "
+                           "empty for OpenSCAD's default)")
     (CLI_OPTIONS, CLI_ARGS) = parser.parse_args()
 
 
@@ -233,16 +286,16 @@ if __name__ == "__main__":
     depth = CLI_OPTIONS.depth
     rdepth = CLI_OPTIONS.rdepth
     fname = CLI_OPTIONS.outfile
-    xsizes = [float(x) for x in literal_eval(CLI_ARGS [0])] # should be a list
-    ysizes = [float(x) for x in literal_eval(CLI_ARGS [1])] # should be a list
+    xsizes = array('d', parseList(CLI_ARGS [0])) # given like [40,25,70]
+    ysizes = array('d', parseList(CLI_ARGS [1])) # given like [30,100,60,60]
 
     # Example for replacing the above lines if you don't want to use CLI
     #floor  = 1.5
     #wall   = 1.5
     #depth  = 40
     #rdepth = 15
-    #xsizes = [30,45,60]
-    #ysizes = [50,50,50,50]
+    #xsizes = array('d', [30,45,60])
+    #ysizes = array('d', [50,50,50,50])
 
     if rdepth > depth - 5:
         print('***Warning:  round depth needs to be smaller or equal to bin depth')
@@ -253,25 +306,25 @@ if __name__ == "__main__":
         else:
             rdepth = max(depth - 5, 0)
 
-    xszStrs = [str(int(x)) for x in xsizes]
-    yszStrs = [str(int(y)) for y in ysizes]
-
     print('Floor:  ', floor, 'mm')
     print('Wall:   ', wall, 'mm')
     print('Depth:  ', depth, 'mm')
     print('Round:  ', rdepth, 'mm')
-    print('Widths: ', xsizes, 'mm')
-    print('Heights:', ysizes, 'mm')
+    print('Widths: ', list(xsizes), 'mm')
+    print('Heights:', list(ysizes), 'mm')
 
     # If you don't override fname, the scad file will automatically be named
     if not fname:
-        fname = 'tray_%s_by_%s.scad' % ('x'.join(xszStrs), 'x'.join(yszStrs))
+        fname = (f"tray_{'x'.join(f'{int(x)}' for x in xsizes)}"
+                 f"_by_{'x'.join(f'{int(y)}' for y in ysizes)}.scad")
 
     print('Writing to OpenSCAD file:', fname)
 
-    # Now tell solid python to create the .scad file
+    # Now tell solid python to create the .scad file.  Don't append a copy of
+    # this script to it; the file is only ever fed to OpenSCAD.
     twid,thgt,trayObj = createTray(xsizes, ysizes, depth, rdepth, wall, floor)
-    scad_render_to_file(trayObj, fname, file_header='$fn=64;')
+    scad_render_to_file(trayObj, fname, file_header='$fn=64;',
+                        include_orig_code=False)
 
     ################################################################################
     # EVERYTHING BELOW THIS LINE IS SIMPLY FOR PRINTING ASCII DIAGRAMS
@@ -285,16 +338,13 @@ if __name__ == "__main__":
     totalCharsWide = 82
     totalCharsHigh = float(thgt) / float(twid) * (totalCharsWide / 2.0)
 
-    def getCharsWide(mm):
-        maxInternalChars = totalCharsWide - (len(xsizes) + 1)
-        return max(10, int(maxInternalChars * float(mm) / float(twid)))
+    maxInternalCharsWide = totalCharsWide - (len(xsizes) + 1)
+    maxInternalCharsHigh = totalCharsHigh - (len(ysizes) + 1)
+    xchars = [max(10, int(maxInternalCharsWide * x / twid)) for x in xsizes]
+    ychars = [max(2, int(maxInternalCharsHigh * y / thgt)) for y in ysizes]
 
-    def getCharsHigh(mm):
-        maxInternalChars = totalCharsHigh - (len(ysizes) + 1)
-        return max(2, int(maxInternalChars * float(mm) / float(thgt)))
-
-    xchars = [getCharsWide(x) for x in xsizes]
-    ychars = [getCharsHigh(y) for y in ysizes]
+    # The labels go on the middle line of each row (the cups just above it)
+    yhalf = [yc // 2 for yc in ychars]
 
     print('')
     print('')
@@ -302,40 +352,46 @@ if __name__ == "__main__":
     wCharsTotal = sum(xchars) + len(xchars) + 1
     hCharsTotal = sum(ychars) + len(ychars) + 1
 
-    vertLine = ' ' * 10 + '-' * wCharsTotal + '\n'
-    sys.stdout.write(vertLine)
+    # Compute the volume of every slot once, rather than once per line of text
+    mLTable,cupsTable = computeSlotVolumes(xsizes, ysizes, depth, rdepth)
+
+    # The text in each cell only depends on the cell, so center it up front
+    cupsStr = [[('%0.2f cups' % cupsTable [j][i]).center(xchars [i])
+                for i in range(len(xsizes))] for j in range(len(ysizes))]
+    mlStr = [[('%0.1f mL' % mLTable [j][i]).center(xchars [i])
+              for i in range(len(xsizes))] for j in range(len(ysizes))]
+    blankStr = [' ' * xc for xc in xchars]
+
+    # Every line of the diagram that doesn't carry a label is the same
+    blankLine = diagramRowPrefix + '|'.join(blankStr) + '|\n'
+
+    # Build the whole diagram in memory and write it out in one go
+    out = []
+    vertLine = diagramMargin + '-' * wCharsTotal + '\n'
+    out.append(vertLine)
     for j in range(len(ysizes)):
         # Acually do the y-values in reverse since printing to console happens
         # in the negative y-direction.
         revj = len(ysizes) - j - 1
 
         for jc in range(ychars [revj]):
-            yhgt = ychars [revj]
-            if jc == yhgt / 2:
-                sys.stdout.write( ('%0.1f mm' % ysizes [revj]).center(10) + '|')
+            if jc == yhalf [revj] - 1:
+                out.append(diagramRowPrefix + '|'.join(cupsStr [revj]) + '|\n')
+            elif jc == yhalf [revj]:
+                out.append( ('%0.1f mm' % ysizes [revj]).center(10) + '|' +
+                            '|'.join(mlStr [revj]) + '|\n')
             else:
-                sys.stdout.write(' ' * 10 + '|')
-
-            for i in range(len(xsizes)):
-                mL,cups = computeSlotVolume(xsizes [i], ysizes [revj], depth, rdepth)
-
-                if jc == yhgt / 2 - 1:
-                    sys.stdout.write( ('%0.2f cups' % cups).center(xchars [i]))
-                elif jc == yhgt / 2:
-                    sys.stdout.write( ('%0.1f mL' % mL).center(xchars [i]))
-                else:
-                    sys.stdout.write(' ' * (xchars [i]))
-                sys.stdout.write('|')
-            sys.stdout.write('\n')
+                out.append(blankLine)
 
-        sys.stdout.write(vertLine)
+        out.append(vertLine)
 
-    sys.stdout.write('\n')
-    sys.stdout.write(' ' * 10)
+    out.append('\n')
+    out.append(diagramMargin)
     for i in range(len(xsizes)):
         sizeStr = '%0.1f mm' % xsizes [i]
-        sys.stdout.write(sizeStr.center(xchars [i] + 1))
-    sys.stdout.write('\n\n')
+        out.append(sizeStr.center(xchars [i] + 1))
+    out.append('\n\n')
+    sys.stdout.write(''.join(out))
 
     print('Total Width  (with walls):  %3.1f mm   (%3.2f cm)' % (twid,  twid / 10.0))
     print('Total Height (with walls):  %3.1f mm   (%3.2f cm)' % (thgt,  thgt / 10.0))
@@ -346,6 +402,22 @@ if __name__ == "__main__":
     if ok.lower().startswith('y'):
         stlname = fname + '.stl'
         print('Converting to STL file:', stlname,)
-        proc = subprocess.Popen('openscad -o "%s" "%s"' % (stlname, fname), shell=True)
-        while proc.poll() == None:
-            time.sleep(0.1)
+        # The manifold backend is much faster than CGAL at all the slot
+        # subtractions, but older OpenSCAD releases (like 2021.01) reject the
+        # --backend option, so only pass it if this openscad lists it.
+        try:
+            scadCmd = ['openscad']
+            if CLI_OPTIONS.backend:
+                scadHelp = subprocess.run(['openscad', '--help'],
+                                          capture_output=True, text=True)
+                if '--backend' in scadHelp.stdout + scadHelp.stderr:
+                    scadCmd.append('--backend=' + CLI_OPTIONS.backend)
+                else:
+                    print('***This openscad has no --backend option, using its default backend')
+            proc = subprocess.run(scadCmd + ['-o', stlname, fname])
+        except FileNotFoundError:
+            print('***ERROR: Could not find openscad, is it installed and in your PATH?')
+            exit(1)
+        if proc.returncode != 0:
+            print('***ERROR: openscad failed (exit code %d), no STL file was created' % proc.returncode)
+            exit(1)